@@ -0,0 +1,175 @@
+"""
+This is the command-line driver for re-analyzing specific Lichess games by ID or URL.
+
+Example:
+    python cli.py Jrjrjr4 --white https://lichess.org/study/14RZiFdX \\
+        --black https://lichess.org/study/bve0Qw48 EE8nALl4 https://lichess.org/abcdefgh/black
+"""
+
+import argparse
+import contextlib
+import shlex
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import chess.engine
+from logic import lichess_api
+from logic import pgn_utils
+from logic.chess_utils import find_deviation_in_entire_study_white_and_black
+from logic.deviation_result import DeviationResult
+from logic.engine_eval import DeviationEvaluation, EnginePool
+
+
+def format_deviation(
+    deviation_info: Optional[DeviationResult],
+    evaluation: Optional[DeviationEvaluation] = None,
+) -> str:
+    """
+    Formats a deviation result as a single line of text.
+
+    :param deviation_info: DeviationResult or None, information about the deviation
+    :param evaluation: DeviationEvaluation or None, the engine evaluation of the deviation
+    :return: str, the deviating and reference moves, or a note that there was no deviation
+    """
+    if deviation_info is None:
+        return "No deviation found in this game."
+    i = deviation_info.whole_move_number
+    periods = "." if deviation_info.player_color == "White" else "..."
+    line = (
+        f"Deviating move: {i}{periods}{deviation_info.deviation_san}, "
+        f"reference move: {i}{periods}{deviation_info.reference_san}"
+    )
+    if evaluation is not None:
+        line += (
+            f" ({evaluation.deviation_cp:+d} vs {evaluation.reference_cp:+d} cp, "
+            f"loss {evaluation.loss_cp} cp)"
+        )
+    return line
+
+
+def evaluate_deviations(
+    pool: EnginePool, sites: list[str], info_list: list[Optional[DeviationResult]]
+) -> list[Optional[DeviationEvaluation]]:
+    """
+    Evaluates the deviations of several games on the engine pool, reporting the engine errors.
+
+    :param pool: EnginePool, the engines to evaluate with
+    :param sites: list[str], the site of each game, to report the errors with
+    :param info_list: list[Optional[DeviationResult]], the deviation of each game, or None
+    :return: list[Optional[DeviationEvaluation]], the evaluation of each deviation, or None
+        if there was no deviation or the engine failed on it
+    """
+    def evaluate(site: str, deviation_info: Optional[DeviationResult]) -> Optional[DeviationEvaluation]:
+        if deviation_info is None:
+            return None
+        try:
+            return pool.evaluate_deviation(deviation_info)
+        except chess.engine.EngineError as e:
+            print(f"{site}: not evaluated ({e})", file=sys.stderr)
+            return None
+
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        return list(executor.map(evaluate, sites, info_list))
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Find where specific Lichess games left your opening repertoire."
+    )
+    parser.add_argument("username", help="your Lichess username")
+    parser.add_argument("--white", required=True, help="the URL of your White Lichess study")
+    parser.add_argument("--black", required=True, help="the URL of your Black Lichess study")
+    parser.add_argument(
+        "--ids-file",
+        type=argparse.FileType("r"),
+        help="a file with one game ID or URL per line",
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=1,
+        help="the maximum number of export requests in flight (default is 1)",
+    )
+    parser.add_argument(
+        "--engine",
+        help="the command of a UCI engine, to evaluate how much each deviation cost",
+    )
+    parser.add_argument(
+        "--engine-pool",
+        type=int,
+        default=2,
+        help="the number of engine processes (default is 2)",
+    )
+    parser.add_argument(
+        "--engine-depth",
+        type=int,
+        default=18,
+        help="the search depth of each evaluation (default is 18)",
+    )
+    parser.add_argument(
+        "--engine-time",
+        type=float,
+        help="the search time of each evaluation in seconds, used instead of the depth",
+    )
+    parser.add_argument(
+        "--engine-cache",
+        default="engine_cache.sqlite3",
+        help="the path of the evaluation cache (default is engine_cache.sqlite3)",
+    )
+    parser.add_argument("games", nargs="*", help="Lichess game IDs or URLs")
+    args = parser.parse_intermixed_args(argv)
+
+    game_ids = list(args.games)
+    if args.ids_file:
+        game_ids.extend(line.strip() for line in args.ids_file if line.strip())
+    if not game_ids:
+        parser.error("no games given")
+
+    white_study = lichess_api.Study.fetch_url(args.white)
+    black_study = lichess_api.Study.fetch_url(args.black)
+    with contextlib.ExitStack() as stack:
+        pool = None
+        if args.engine:
+            pool = stack.enter_context(
+                EnginePool(
+                    shlex.split(args.engine),
+                    size=args.engine_pool,
+                    depth=args.engine_depth,
+                    time_limit=args.engine_time,
+                    cache_path=args.engine_cache,
+                )
+            )
+        batches = lichess_api.get_games_pgn_by_ids(
+            game_ids, max_workers=args.max_workers
+        )
+        for batch_number, pgn_data in enumerate(batches, start=1):
+            if pgn_data is None:
+                print(f"Batch {batch_number}: failed to fetch, skipped", file=sys.stderr)
+                continue
+            if not pgn_data.strip():
+                continue
+            sites = []
+            info_list = []
+            for game in pgn_utils.pgn_to_pgn_list(pgn_data):
+                site = game.headers.get("Site", "?")
+                try:
+                    deviation_info = find_deviation_in_entire_study_white_and_black(
+                        white_study, black_study, game, args.username
+                    )
+                except Exception as e:
+                    print(f"{site}: skipped ({e})", file=sys.stderr)
+                    continue
+                sites.append(site)
+                info_list.append(deviation_info)
+            evaluations = (
+                evaluate_deviations(pool, sites, info_list) if pool else [None] * len(info_list)
+            )
+            for site, deviation_info, evaluation in zip(
+                sites, info_list, evaluations, strict=True
+            ):
+                print(f"{site}: {format_deviation(deviation_info, evaluation)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,7 +5,7 @@ This module provides utility functions for chess analysis.
 import os
 from typing import Optional
 import chess.pgn
-from .deviation_result import DeviationResult
+from .deviation_result import BookExit, DeviationResult
 from .lichess_api import Study
 
 from streamlit.logger import get_logger
@@ -17,52 +17,46 @@ def compare_moves(
     repertoire_board: chess.Board,
     rep_move: chess.Move,
     recent_move: chess.Move,
-    player_color: str,
+    half_move_number: int,
     my_color: str,
-    whole_move_number: int,
-) -> Optional[DeviationResult]:
+) -> BookExit:
     """
-    Compares a pair of moves from recent and repertoire games, checking for deviations.
+    Describes where a recent game left the repertoire, given the first pair of moves that differ.
 
     :param recent_board: chess.Board, the chess board with the recent game's state.
     :param repertoire_board: chess.Board, the chess board with the repertoire game's state.
     :param rep_move: chess.Move, the current move from the repertoire game.
     :param recent_move: chess.Move, the current move from the recent game.
-    :param player_color: str, the color of the player making the current move.
+    :param half_move_number: int, the ply of the current move, starting at 1.
     :param my_color: str, the color the user is playing in the recent game.
-    :param whole_move_number: int, the whole move number for display.
-    :return: DeviationResult, or None if there's no deviation.
+    :return: BookExit, the exit from the repertoire, by either player.
     """
     illegal_msg = (
         f"Illegal move: {recent_move} at position {recent_board.fen()}"
     )
     assert recent_move in recent_board.legal_moves, illegal_msg
-    if (
-        my_color != player_color
-    ):  # If the opponent was first to deviate, return None
-        return None
-    deviation_san = recent_board.san(recent_move)
-    reference_san = repertoire_board.san(rep_move)
-    return DeviationResult(
-        whole_move_number,
-        deviation_san,
-        reference_san,
+    player_color = "White" if recent_board.turn else "Black"
+    return BookExit(
+        half_move_number,
+        recent_board.san(recent_move),
+        [repertoire_board.san(rep_move)],
         player_color,
+        player_color == my_color,
         recent_board,
     )
 
 
-def find_deviation(
+def find_book_exit(
     repertoire_game: chess.pgn.Game, recent_game: chess.pgn.Game, username: str
-) -> Optional[DeviationResult]:
+) -> Optional[BookExit]:
     """
     Compares the moves of a recent game against a repertoire game
-    and finds the first move that deviates.
+    and finds the first move that leaves the repertoire, by either player.
 
     :param repertoire_game: chess.pgn.Game, the opening repertoire game
     :param recent_game: chess.pgn.Game, the recent game to compare against the repertoire
     :param username: str, the name or identifier of the player
-    :return: DeviationResult, or None if there's no deviation
+    :return: BookExit, or None if the game never left the repertoire
     """
     # Initialize a board for each game to track the position
     repertoire_board = repertoire_game.board()
@@ -76,10 +70,6 @@ def find_deviation(
         zip(repertoire_moves, my_game_moves, strict=False), start=1
     )
     for half_move_number, (rep_move, recent_move) in moves_list:
-        player_color = "White" if recent_board.turn else "Black"
-        # Whole move count for display; move_number will be measured in ply (half-moves)
-        whole_move_number = (half_move_number + 1) // 2
-
         # Compare moves before pushing them to the board
         if rep_move != recent_move:
             return compare_moves(
@@ -87,9 +77,8 @@ def find_deviation(
                 repertoire_board,
                 rep_move,
                 recent_move,
-                player_color,
+                half_move_number,
                 my_color,
-                whole_move_number,
             )
         # If the moves are the same, then push them to their respective boards
         recent_board.push(recent_move)
@@ -99,6 +88,58 @@ def find_deviation(
     return None
 
 
+def find_deviation(
+    repertoire_game: chess.pgn.Game, recent_game: chess.pgn.Game, username: str
+) -> Optional[DeviationResult]:
+    """
+    Compares the moves of a recent game against a repertoire game
+    and finds the first move that deviates.
+
+    :param repertoire_game: chess.pgn.Game, the opening repertoire game
+    :param recent_game: chess.pgn.Game, the recent game to compare against the repertoire
+    :param username: str, the name or identifier of the player
+    :return: DeviationResult, or None if there's no deviation
+    """
+    return _player_deviation(
+        find_book_exit(repertoire_game, recent_game, username)
+    )
+
+
+def find_book_exit_in_chapters(
+    chapters: list[chess.pgn.Game], recent_game: chess.pgn.Game, username: str
+) -> Optional[BookExit]:
+    """
+    Scans a recent game once against each repertoire chapter and finds where it left the book.
+
+    The first chapter in which the player deviates wins, as with find_deviation. Otherwise,
+    if every chapter was left by the opponent, the deepest opponent exit is returned, with
+    the expected moves of every chapter that was followed up to that ply.
+
+    :param chapters: list[chess.pgn.Game], the repertoire games to compare against
+    :param recent_game: chess.pgn.Game, the recent game to compare against the repertoire
+    :param username: str, the name or identifier of the player
+    :return: BookExit, or None if the game never left the repertoire
+    """
+    opponent_exit: Optional[BookExit] = None
+    stayed_in_book = False
+    for ref_game in chapters:
+        book_exit = find_book_exit(ref_game, recent_game, username)
+        if book_exit is None:
+            stayed_in_book = True
+        elif book_exit.by_player:
+            return book_exit
+        elif opponent_exit is None or book_exit.ply > opponent_exit.ply:
+            opponent_exit = book_exit
+        elif book_exit.ply == opponent_exit.ply:
+            for san in book_exit.expected_sans:
+                if san not in opponent_exit.expected_sans:
+                    opponent_exit.expected_sans.append(san)
+    # A chapter that was followed to its end means the opponent never left the book
+    if stayed_in_book:
+        return None
+    return opponent_exit
+
+
 def find_deviation_in_entire_study(
     study: Study, recent_game: chess.pgn.Game, username: str
 ) -> Optional[DeviationResult]:
@@ -111,28 +152,26 @@ def find_deviation_in_entire_study(
     :param username: str, the name or identifier of the player
     :return: DeviationResult, or None if there's no deviation
     """
-    for ref_game in study.chapters:
-        deviation = find_deviation(ref_game, recent_game, username)
-        if deviation:
-            return deviation
-    return None
+    return _player_deviation(
+        find_book_exit_in_chapters(study.chapters, recent_game, username)
+    )
 
 
-def find_deviation_in_entire_study_white_and_black(
+def find_book_exit_in_entire_study_white_and_black(
     white_study: Study,
     black_study: Study,
     recent_game: chess.pgn.Game,
     username: str,
-) -> Optional[DeviationResult]:
+) -> Optional[BookExit]:
     """
-    Compares the moves of a recent game against a study of repertoire games, one per chapter,
-    and finds the first move that deviates.
+    Compares the moves of a recent game against the study for the color the player had,
+    and finds where the game first left the repertoire, by either player.
 
     :param white_study: the white repertoire Study
     :param black_study: the black repertoire Study
     :param recent_game: chess.pgn.Game, the recent game to compare against the repertoire
     :param username: str, the name or identifier of the player
-    :return: DeviationResult, or None if there's no deviation
+    :return: BookExit, or None if the game never left the repertoire
     """
     player_color = get_player_color(recent_game, username)
     if player_color == "White":
@@ -142,11 +181,42 @@ def find_deviation_in_entire_study_white_and_black(
     else:
         raise Exception(f"Could not find player {username} in provided game")
 
-    for ref_game in study.chapters:
-        deviation = find_deviation(ref_game, recent_game, username)
-        if deviation:
-            return deviation
-    return None
+    return find_book_exit_in_chapters(study.chapters, recent_game, username)
+
+
+def find_deviation_in_entire_study_white_and_black(
+    white_study: Study,
+    black_study: Study,
+    recent_game: chess.pgn.Game,
+    username: str,
+) -> Optional[DeviationResult]:
+    """
+    Compares the moves of a recent game against a study of repertoire games, one per chapter,
+    and finds the first move that deviates.
+
+    :param white_study: the white repertoire Study
+    :param black_study: the black repertoire Study
+    :param recent_game: chess.pgn.Game, the recent game to compare against the repertoire
+    :param username: str, the name or identifier of the player
+    :return: DeviationResult, or None if there's no deviation
+    """
+    return _player_deviation(
+        find_book_exit_in_entire_study_white_and_black(
+            white_study, black_study, recent_game, username
+        )
+    )
+
+
+def _player_deviation(book_exit: Optional[BookExit]) -> Optional[DeviationResult]:
+    """
+    Keeps only the exits made by the player, as a DeviationResult.
+
+    :param book_exit: BookExit, or None if the game never left the repertoire
+    :return: DeviationResult, or None if the opponent left first or there was no exit
+    """
+    if book_exit is None or not book_exit.by_player:
+        return None
+    return book_exit.to_deviation_result()
 
 
 def get_player_color(
@@ -159,12 +229,13 @@ def get_player_color(
     :param player_name: str, the name or identifier of the player
     :return: 'White' if the player was White, 'Black' if the player was Black, or None if no match
     """
-    white_player = recent_game.headers["White"]
-    black_player = recent_game.headers["Black"]
+    # Lichess usernames are case-insensitive
+    white_player = recent_game.headers["White"].lower()
+    black_player = recent_game.headers["Black"].lower()
 
-    if player_name == white_player:
+    if player_name.lower() == white_player:
         return "White"
-    if player_name == black_player:
+    if player_name.lower() == black_player:
         return "Black"
     # Else:
     raise Exception(f"Could not find match {player_name} to the game!")
@@ -54,3 +54,75 @@ class DeviationResult:
             and self.player_color == other.player_color
             # Note: We're intentionally not comparing the 'board' attribute here.
         )
+
+
+class BookExit:
+    """
+    Represents the first point where a game leaves the repertoire, whoever left it.
+
+    Attributes:
+        ply (int): The half-move number (starting at 1) of the move that left the repertoire.
+        played_san (str): The SAN of the move that was actually played.
+        expected_sans (list[str]): The SAN of the repertoire move(s) expected at that ply.
+        player_color (str): The color of the side that left the repertoire.
+        by_player (bool): True if the user left the repertoire, False if the opponent did.
+        board (chess.Board): A board state to represent the position right before the exit.
+    """
+
+    def __init__(
+        self,
+        ply: int,
+        played_san: str,
+        expected_sans: list[str],
+        player_color: str,
+        by_player: bool,
+        board: Optional[chess.Board] = None,
+    ):
+        self.ply = ply
+        self.played_san = played_san
+        self.expected_sans = expected_sans
+        self.player_color = player_color
+        self.by_player = by_player
+        self.board = chess.Board() if board is None else board
+
+    @property
+    def whole_move_number(self) -> int:
+        """The whole move number of the exit, for display."""
+        return (self.ply + 1) // 2
+
+    def to_deviation_result(self) -> DeviationResult:
+        """
+        Converts this exit into a DeviationResult, using the first expected repertoire move.
+
+        :return: DeviationResult, the equivalent deviation result
+        """
+        return DeviationResult(
+            self.whole_move_number,
+            self.played_san,
+            self.expected_sans[0],
+            self.player_color,
+            self.board,
+        )
+
+    def __repr__(self):
+        return (
+            f"BookExit(ply={self.ply}, "
+            f"played_san={self.played_san!r}, "
+            f"expected_sans={self.expected_sans!r}, "
+            f"player_color={self.player_color!r}, "
+            f"by_player={self.by_player!r}, "
+            f"board_fen={self.board.fen()!r})"
+        )
+
+    def __eq__(self, other):
+        if not isinstance(other, BookExit):
+            return NotImplemented
+
+        return (
+            self.ply == other.ply
+            and self.played_san == other.played_san
+            and self.expected_sans == other.expected_sans
+            and self.player_color == other.player_color
+            and self.by_player == other.by_player
+            # Note: We're intentionally not comparing the 'board' attribute here.
+        )
@@ -0,0 +1,299 @@
+"""
+This module evaluates deviations with a pool of local UCI engines, caching every evaluation on disk.
+"""
+
+import dataclasses
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Sequence, Union
+import chess
+import chess.engine
+from .deviation_result import DeviationResult
+
+from streamlit.logger import get_logger
+LOG = get_logger(__name__)
+
+# Centipawn value given to forced mates, so that every evaluation is a plain number
+MATE_SCORE = 100000
+
+
+@dataclasses.dataclass
+class DeviationEvaluation:
+    """
+    The engine evaluations of the deviating move and the reference move of a deviation,
+    in centipawns from the point of view of the player who deviated.
+    """
+
+    deviation: DeviationResult
+    deviation_cp: int
+    reference_cp: int
+
+    @property
+    def loss_cp(self) -> int:
+        """How many centipawns the deviating move gave up compared with the reference move."""
+        return self.reference_cp - self.deviation_cp
+
+
+class EvaluationCache:
+    """
+    An on-disk cache of move evaluations, keyed by position, move and search limit.
+
+    Positions are keyed by EPD, which leaves out the move counters, so a position reached
+    again later in another game still hits the cache.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: str, the path of the SQLite database, created if it does not exist
+        """
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS evaluations ("
+                "epd TEXT, move TEXT, search_limit TEXT, cp INTEGER, "
+                "PRIMARY KEY (epd, move, search_limit))"
+            )
+
+    def get(self, epd: str, move: str, search_limit: str) -> Optional[int]:
+        """
+        Looks up the evaluation of a move.
+
+        :param epd: str, the EPD of the position before the move
+        :param move: str, the move in UCI notation
+        :param search_limit: str, the key of the search limit, like depth=18
+        :return: Optional[int], the evaluation in centipawns, or None if it is not cached
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT cp FROM evaluations WHERE epd = ? AND move = ? AND search_limit = ?",
+                (epd, move, search_limit),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, epd: str, move: str, search_limit: str, cp: int) -> None:
+        """
+        Stores the evaluation of a move, replacing any previous one.
+
+        :param epd: str, the EPD of the position before the move
+        :param move: str, the move in UCI notation
+        :param search_limit: str, the key of the search limit, like depth=18
+        :param cp: int, the evaluation in centipawns
+        :return: None
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO evaluations VALUES (?, ?, ?, ?)",
+                (epd, move, search_limit, cp),
+            )
+
+    def close(self) -> None:
+        """
+        Closes the database connection.
+
+        :return: None
+        """
+        with self._lock:
+            self._connection.close()
+
+
+class EnginePool:
+    """
+    A pool of persistent UCI engine processes that evaluate moves at a fixed depth or time budget.
+
+    Engines are started on the first evaluation that misses the cache, up to the pool size,
+    and are reused until the pool is closed. Use it as a context manager to close it.
+    """
+
+    def __init__(
+        self,
+        command: Union[str, Sequence[str]],
+        size: int = 2,
+        depth: Optional[int] = 18,
+        time_limit: Optional[float] = None,
+        cache_path: str = "engine_cache.sqlite3",
+    ):
+        """
+        :param command: the command that starts the UCI engine, as a path or an argument list
+        :param size: int, the maximum number of engine processes (default is 2)
+        :param depth: int, the search depth of each evaluation (default is 18)
+        :param time_limit: float, the search time of each evaluation in seconds, used instead of
+            the depth if given
+        :param cache_path: str, the path of the evaluation cache (default is engine_cache.sqlite3)
+        """
+        if size < 1:
+            raise ValueError(f"size must be at least 1, got {size}")
+        if time_limit is not None:
+            self.limit = chess.engine.Limit(time=time_limit)
+            self.limit_key = f"time={time_limit}"
+        elif depth is not None:
+            self.limit = chess.engine.Limit(depth=depth)
+            self.limit_key = f"depth={depth}"
+        else:
+            raise ValueError("Either a depth or a time limit is required")
+        self.command = command
+        self.size = size
+        self.cache = EvaluationCache(cache_path)
+        self._engines: list[chess.engine.SimpleEngine] = []
+        # Idle engines, plus None for each slot where no engine has been started yet.
+        # Last in, first out, so running engines are reused before new ones are started.
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        for _ in range(size):
+            self._idle.put(None)
+        self._lock = threading.Lock()
+        # The searches in progress, so that concurrent requests for the same one can share it
+        self._pending: dict[tuple[str, str], Future] = {}
+        self._pending_lock = threading.Lock()
+
+    def __enter__(self) -> "EnginePool":
+        """
+        :return: EnginePool, the pool itself
+        """
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        """
+        Closes the pool, whether or not an exception was raised.
+
+        :param exc_info: the exception type, value and traceback, or None for each
+        :return: None
+        """
+        self.close()
+
+    def evaluate_move(self, board: chess.Board, move: chess.Move) -> int:
+        """
+        Evaluates a move, in centipawns from the point of view of the side to move.
+
+        If the same move is already being searched from the same position, this waits for
+        that search instead of starting another one.
+
+        :param board: chess.Board, the position before the move
+        :param move: chess.Move, the move to evaluate
+        :return: int, the evaluation of the position after the best play following the move
+        """
+        epd = board.epd()
+        cp = self.cache.get(epd, move.uci(), self.limit_key)
+        if cp is not None:
+            return cp
+
+        key = (epd, move.uci())
+        with self._pending_lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                # The search may have finished since the cache was read
+                cp = self.cache.get(epd, move.uci(), self.limit_key)
+                if cp is not None:
+                    return cp
+                future: Future = Future()
+                self._pending[key] = future
+        if pending is not None:
+            return pending.result()
+
+        try:
+            cp = self._search(board, move)
+            self.cache.put(epd, move.uci(), self.limit_key, cp)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(cp)
+            return cp
+        finally:
+            with self._pending_lock:
+                del self._pending[key]
+
+    def evaluate_deviation(self, deviation: DeviationResult) -> DeviationEvaluation:
+        """
+        Evaluates the deviating move and the reference move of a deviation.
+
+        :param deviation: DeviationResult, the deviation to evaluate
+        :return: DeviationEvaluation, the evaluations of both moves
+        """
+        board = deviation.board
+        return DeviationEvaluation(
+            deviation,
+            self.evaluate_move(board, board.parse_san(deviation.deviation_san)),
+            self.evaluate_move(board, board.parse_san(deviation.reference_san)),
+        )
+
+    def evaluate_deviations(
+        self, deviations: list[Optional[DeviationResult]]
+    ) -> list[Optional[DeviationEvaluation]]:
+        """
+        Evaluates a list of deviations, spreading them over the engines of the pool.
+
+        :param deviations: List[Optional[DeviationResult]], the deviations, or None for games without one
+        :return: List[Optional[DeviationEvaluation]], the evaluation of each deviation, or None
+        """
+        def evaluate(deviation: Optional[DeviationResult]) -> Optional[DeviationEvaluation]:
+            return None if deviation is None else self.evaluate_deviation(deviation)
+
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            return list(executor.map(evaluate, deviations))
+
+    def close(self) -> None:
+        """
+        Stops every engine process and closes the cache.
+
+        :return: None
+        """
+        with self._lock:
+            for engine in self._engines:
+                engine.quit()
+            self._engines.clear()
+        self.cache.close()
+
+    def _search(self, board: chess.Board, move: chess.Move) -> int:
+        """
+        Searches a move on an engine of the pool, replacing the engine if it fails.
+
+        :param board: chess.Board, the position before the move
+        :param move: chess.Move, the move to evaluate
+        :return: int, the evaluation of the position after the best play following the move
+        """
+        engine = self._acquire()
+        try:
+            info = engine.analyse(board, self.limit, root_moves=[move])
+        except Exception:
+            # The engine may have crashed, so never hand it out again
+            self._discard(engine)
+            raise
+        self._idle.put(engine)
+        return info["score"].pov(board.turn).score(mate_score=MATE_SCORE)
+
+    def _acquire(self) -> chess.engine.SimpleEngine:
+        """
+        Takes an idle engine, starting a new one if none is idle and the pool is not full yet.
+
+        :return: chess.engine.SimpleEngine, an engine reserved for the caller
+        """
+        engine = self._idle.get()
+        if engine is not None:
+            return engine
+        # A free slot in the pool: start an engine for it
+        try:
+            engine = chess.engine.SimpleEngine.popen_uci(self.command)
+        except Exception:
+            self._idle.put(None)
+            raise
+        with self._lock:
+            self._engines.append(engine)
+            LOG.info("Started engine %s of %s", len(self._engines), self.size)
+        return engine
+
+    def _discard(self, engine: chess.engine.SimpleEngine) -> None:
+        """
+        Stops an engine and frees its slot in the pool, so that a new one can be started.
+
+        :param engine: chess.engine.SimpleEngine, the engine to discard
+        :return: None
+        """
+        with self._lock:
+            self._engines.remove(engine)
+        try:
+            engine.close()
+        except Exception as e:
+            LOG.warning("Could not stop engine: %s", e)
+        self._idle.put(None)
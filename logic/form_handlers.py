@@ -2,15 +2,19 @@
 This module provides the logic for the user input/output on the website through streamlit.
 """
 
+import functools
+import math
 from typing import Optional, List
 import chess
 import chess.svg
 from chess.svg import Arrow
+import requests
 import streamlit as st
 from streamlit import logger
 from . import lichess_api
+from . import ndjson_utils
 from . import pgn_utils
-from .lichess_api import get_last_games_pgn
+from .lichess_api import GameFilters, get_last_games_pgn
 from .chess_utils import (
     find_deviation_in_entire_study_white_and_black,
 )
@@ -18,6 +22,24 @@ from .deviation_result import DeviationResult
 
 LOG = logger.get_logger(__name__)
 
+GRID_BOARD_SIZE = 200
+
+# The layout of chess.svg boards with coordinates, which the compact grid draws on
+_SVG_MARGIN = 15
+_SVG_BOARD_SIZE = 8 * chess.svg.SQUARE_SIZE + 2 * _SVG_MARGIN
+
+# Cached results are shared across reruns and sessions; keep them fresh and bounded
+CACHE_TTL_SECONDS = 15 * 60
+GAMES_CACHE_MAX_ENTRIES = 32
+STUDY_CACHE_MAX_ENTRIES = 16
+ANALYSIS_CACHE_MAX_ENTRIES = 32
+
+
+class GamesFetchError(Exception):
+    """
+    Raised when the games of a user could not be fetched, so that the failure is not cached.
+    """
+
 
 def display_deviation_info(deviation_info: Optional[DeviationResult]) -> None:
     """
@@ -88,62 +110,266 @@ def get_board_svg_with_arrows(
     return svg
 
 
-def display_image_grid(images: List[str], max_cols: int = 4) -> None:
+def get_compact_grid_html(
+    deviation_list: List[Optional[DeviationResult]], max_cols: int = 4
+) -> str:
     """
-    Displays a grid of SVG images in Streamlit, ensuring up to a
-    specified maximum number of columns.
+    From a list of deviations, form a single HTML grid of boards that share their SVG definitions.
+
+    The pieces and the board frame for each orientation are defined once, and each board only
+    references them through <use>, so it carries nothing but its piece placements and arrows.
 
-    :param images: List of SVG formatted images as strings.
+    :param deviation_list: List[Optional[DeviationResult]], the list of deviations
+    :param max_cols: Maximum number of columns in the grid. Defaults to 4.
+    :return: str, the HTML of the whole grid
+    """
+    # The frame (squares and coordinates) of each orientation is a whole empty chess.svg board
+    frames = "".join(
+        f'<g id="board-frame-{name}">{chess.svg.board(None, orientation=orientation)}</g>'
+        for name, orientation in (("white", chess.WHITE), ("black", chess.BLACK))
+    )
+    defs = (
+        '<svg width="0" height="0" style="position:absolute">'
+        f'<defs>{"".join(chess.svg.PIECES.values())}{frames}</defs></svg>'
+    )
+    boards = "".join(_get_compact_board_svg(info) for info in deviation_list)
+    return (
+        f"{defs}<div style=\"display:grid; "
+        f'grid-template-columns:repeat({max_cols}, minmax(0, {GRID_BOARD_SIZE}px)); gap:8px;">'
+        f"{boards}</div>"
+    )
+
+
+def display_compact_grid(
+    deviation_list: List[Optional[DeviationResult]], max_cols: int = 4
+) -> None:
+    """
+    Displays a grid of deviation boards in Streamlit as a single document with shared SVG definitions.
+
+    :param deviation_list: List[Optional[DeviationResult]], the list of deviations
     :param max_cols: Maximum number of columns in the grid. Defaults to 4.
     :return: None
     """
-    cols = st.columns(max_cols)  # Prepare columns
+    st.markdown(
+        get_compact_grid_html(deviation_list, max_cols), unsafe_allow_html=True
+    )
+
 
-    for idx, image in enumerate(images):
-        # Assuming SVGs might need width adjustment; insert style attribute for width control
-        updated_image = image.replace(
-            "<svg ", '<svg style="width:100%; height:auto;" ', 1
+def _get_compact_board_svg(deviation_info: Optional[DeviationResult]) -> str:
+    """
+    Get the svg for a single board of the compact grid, referencing the shared definitions.
+
+    :param deviation_info: DeviationResult, a deviation from your game, or None if there was no deviation
+    :return: str, the svg data with only the piece placements and arrows of the board
+    """
+    frame = "white"
+    elements = []
+    if deviation_info:
+        board = deviation_info.board
+        orientation = chess.WHITE if deviation_info.player_color == "White" else chess.BLACK
+        frame = "white" if orientation == chess.WHITE else "black"
+        for square, piece in board.piece_map().items():
+            x, y = _get_square_origin(square, orientation)
+            piece_id = f"{chess.COLOR_NAMES[piece.color]}-{chess.PIECE_NAMES[piece.piece_type]}"
+            elements.append(f'<use href="#{piece_id}" transform="translate({x}, {y})" />')
+        reference_move = board.parse_san(deviation_info.reference_san)
+        deviation_move = board.parse_san(deviation_info.deviation_san)
+        elements.append(_get_arrow_svg(reference_move, "blue", orientation))
+        elements.append(_get_arrow_svg(deviation_move, "red", orientation))
+    # Else there was no deviation, and the board is left clear
+    return (
+        f'<svg viewBox="0 0 {_SVG_BOARD_SIZE} {_SVG_BOARD_SIZE}" style="width:100%; height:auto;">'
+        f'<use href="#board-frame-{frame}" />{"".join(elements)}</svg>'
+    )
+
+
+def _get_square_origin(square: chess.Square, orientation: chess.Color) -> tuple[int, int]:
+    """
+    Get the top left corner of a square, laid out the same way as chess.svg.board.
+
+    :param square: chess.Square, the square
+    :param orientation: chess.Color, the side at the bottom of the board
+    :return: tuple[int, int], the x and y coordinates of the corner
+    """
+    file_index = chess.square_file(square)
+    rank_index = chess.square_rank(square)
+    x = (file_index if orientation else 7 - file_index) * chess.svg.SQUARE_SIZE + _SVG_MARGIN
+    y = (7 - rank_index if orientation else rank_index) * chess.svg.SQUARE_SIZE + _SVG_MARGIN
+    return x, y
+
+
+def _get_arrow_svg(move: chess.Move, color: str, orientation: chess.Color) -> str:
+    """
+    Get the svg of an arrow along a move, drawn the same way as chess.svg.board draws arrows.
+    A drop has no origin square, so its target square is circled instead.
+
+    :param move: chess.Move, the move to draw
+    :param color: str, the color of the arrow, like "blue" or "red"
+    :param orientation: chess.Color, the side at the bottom of the board
+    :return: str, the svg elements of the arrow
+    """
+    # Default colors are like #88202080, with the opacity in the last two digits
+    rgba = chess.svg.DEFAULT_COLORS[f"arrow {color}"]
+    rgb, opacity = rgba[1:7], int(rgba[7:], 16) / 0xFF
+    square_size = chess.svg.SQUARE_SIZE
+    xhead, yhead = (c + square_size / 2 for c in _get_square_origin(move.to_square, orientation))
+    if move.drop is not None or move.from_square == move.to_square:
+        return (
+            f'<circle cx="{xhead:.2f}" cy="{yhead:.2f}" r="{square_size * 0.45:.2f}" '
+            f'stroke-width="{square_size * 0.1:.2f}" stroke="#{rgb}" '
+            f'opacity="{opacity:.3f}" fill="none" class="circle" />'
         )
 
-        with cols[idx % max_cols]:
-            st.markdown(updated_image, unsafe_allow_html=True)
+    xtail, ytail = (c + square_size / 2 for c in _get_square_origin(move.from_square, orientation))
+    marker_size = 0.75 * square_size
+    marker_margin = 0.1 * square_size
+    dx, dy = xhead - xtail, yhead - ytail
+    hypot = math.hypot(dx, dy)
+    shaft_x = xhead - dx * (marker_size + marker_margin) / hypot
+    shaft_y = yhead - dy * (marker_size + marker_margin) / hypot
+    tip_x = xhead - dx * marker_margin / hypot
+    tip_y = yhead - dy * marker_margin / hypot
+    # The two corners of the arrow head, on either side of the end of the shaft
+    side_x = dy * 0.5 * marker_size / hypot
+    side_y = dx * 0.5 * marker_size / hypot
+    return (
+        f'<line x1="{xtail:.2f}" y1="{ytail:.2f}" x2="{shaft_x:.2f}" y2="{shaft_y:.2f}" '
+        f'stroke="#{rgb}" opacity="{opacity:.3f}" stroke-width="{square_size * 0.2:.2f}" '
+        f'stroke-linecap="butt" class="arrow" />'
+        f'<polygon points="{tip_x:.2f},{tip_y:.2f} '
+        f'{shaft_x + side_x:.2f},{shaft_y - side_y:.2f} '
+        f'{shaft_x - side_x:.2f},{shaft_y + side_y:.2f}" '
+        f'fill="#{rgb}" opacity="{opacity:.3f}" class="arrow" />'
+    )
 
 
-def get_image_from_deviation_info(
-    deviation_info: Optional[DeviationResult],
+@st.cache_data(
+    ttl=CACHE_TTL_SECONDS,
+    max_entries=GAMES_CACHE_MAX_ENTRIES,
+    show_spinner="Fetching games...",
+)
+def fetch_last_games_pgn_cached(
+    username: str, max_games: int, filters: Optional[GameFilters] = None
 ) -> str:
     """
-    Get the corresponding svg from a deviation result, or return None if there is a None input.
+    Fetches the PGN of the last games played by a user, cached by username and game count.
 
-    :param deviation_info: DeviationResult, a deviation from your game, or None if there was no deviation
-    :return: str, the svg data correpsonding to that result, or a clear board svg if there is no deviation
+    :param username: str, the Lichess username
+    :param max_games: int, the number of games to look at the user's history
+    :param filters: GameFilters, the filters to send to the endpoint. Defaults to None.
+    :return: str, the PGN of the last game(s) played by the user
+    :raises GamesFetchError: if the games could not be fetched
     """
-    if deviation_info:
-        dev_move = deviation_info.deviation_san
-        ref_move = deviation_info.reference_san
-        color = deviation_info.player_color
-        board_svg = get_board_svg_with_arrows(
-            deviation_info.board, ref_move, dev_move, color
+    pgn = get_last_games_pgn(username, max_games, filters=filters)
+    if pgn is None:
+        raise GamesFetchError(f"Error fetching games for {username}!")
+    return pgn
+
+
+@st.cache_resource(
+    ttl=CACHE_TTL_SECONDS,
+    max_entries=STUDY_CACHE_MAX_ENTRIES,
+    show_spinner="Fetching study...",
+)
+def fetch_study_cached(study_url: str) -> lichess_api.Study:
+    """
+    Fetches a Lichess study, cached by URL. The returned Study is shared, so it must not be mutated.
+
+    :param study_url: str, the URL of the Lichess study
+    :return: Study, the fetched study
+    """
+    return lichess_api.Study.fetch_url(study_url)
+
+
+@st.cache_data(
+    ttl=CACHE_TTL_SECONDS,
+    max_entries=ANALYSIS_CACHE_MAX_ENTRIES,
+    show_spinner="Finding deviations...",
+)
+def analyze_games_cached(
+    username: str,
+    study_url_white: str,
+    study_url_black: str,
+    max_games: int,
+    fast_ingest: bool = False,
+    filters: Optional[GameFilters] = None,
+) -> List[Optional[DeviationResult]]:
+    """
+    Finds the deviation of each of the user's last games, cached by the form inputs.
+
+    With fast_ingest, the games are streamed as NDJSON and only their opening moves are parsed,
+    instead of reading every game in full from PGN.
+
+    :param username: str, the Lichess username
+    :param study_url_white: str, the URL of the White Lichess study
+    :param study_url_black: str, the URL of the Black Lichess study
+    :param max_games: int, the number of games to look at the user's history
+    :param fast_ingest: bool, whether to read the games from the NDJSON export. Defaults to False.
+    :param filters: GameFilters, the filters on the user's games. Defaults to None.
+    :return: List[Optional[DeviationResult]], the deviation of each game, or None if there was none
+    :raises GamesFetchError: if the games could not be fetched
+    """
+    if fast_ingest:
+        lines = lichess_api.get_last_games_ndjson(username, max_games, filters=filters)
+        if lines is None:
+            raise GamesFetchError(f"Error fetching games for {username}!")
+        try:
+            test_game_list = ndjson_utils.ndjson_to_game_list(lines)
+        except requests.exceptions.RequestException as e:
+            # The stream broke off after the export had started
+            raise GamesFetchError(f"Error fetching games for {username}: {e}") from e
+        if filters is not None:
+            test_game_list = [
+                game for game in test_game_list if filters.matches(game.headers, username)
+            ]
+    else:
+        test_game_str = fetch_last_games_pgn_cached(username, max_games, filters)
+        header_filter = (
+            None if filters is None else functools.partial(filters.matches, username=username)
         )
-        return board_svg
-    # Else there was no deviation
-    board = chess.Board()
-    board.clear()
-    svg = chess.svg.board(board, size=200)
-    return svg
+        test_game_list = pgn_utils.pgn_to_pgn_list(test_game_str, header_filter)
+    white_study = fetch_study_cached(study_url_white)
+    black_study = fetch_study_cached(study_url_black)
+    return [
+        find_deviation_in_entire_study_white_and_black(
+            white_study, black_study, game, username
+        )
+        for game in test_game_list
+    ]
 
 
-def get_image_grid_from_deviation_list(
-    deviation_list: List[Optional[DeviationResult]],
-) -> List[str]:
+def clear_caches(
+    username: str,
+    study_url_white: str,
+    study_url_black: str,
+    max_games: int,
+    fast_ingest: bool = False,
+    filters: Optional[GameFilters] = None,
+) -> None:
     """
-    From a list of deviations, form a list of svg outputs.
+    Drops the cached fetches and analysis of one submission, so that it starts from scratch.
+    Entries cached for other inputs, including other users' sessions, are kept.
 
-    :param deviation_list: List[Optional[DeviationResult]], the list of deviations
-    :return: List[str], the svg data in a list
+    :param username: str, the Lichess username
+    :param study_url_white: str, the URL of the White Lichess study
+    :param study_url_black: str, the URL of the Black Lichess study
+    :param max_games: int, the number of games to look at the user's history
+    :param fast_ingest: bool, whether to read the games from the NDJSON export. Defaults to False.
+    :param filters: GameFilters, the filters on the user's games. Defaults to None.
+    :return: None
     """
-    svg_data = [get_image_from_deviation_info(info) for info in deviation_list]
-    return svg_data
+    # The arguments must be passed the same way as in the cached calls to match their keys
+    fetch_last_games_pgn_cached.clear(username, max_games, filters)
+    fetch_study_cached.clear(study_url_white)
+    fetch_study_cached.clear(study_url_black)
+    analyze_games_cached.clear(
+        username,
+        study_url_white,
+        study_url_black,
+        max_games,
+        fast_ingest,
+        filters,
+    )
 
 
 def handle_form_submission_grid(
@@ -151,6 +377,9 @@ def handle_form_submission_grid(
     study_url_white: str,
     study_url_black: str,
     max_games: int,
+    force_refresh: bool = False,
+    fast_ingest: bool = False,
+    filters: Optional[GameFilters] = None,
 ) -> None:
     """
     Handles form submission and displays the result in a grid
@@ -159,23 +388,36 @@ def handle_form_submission_grid(
     :param study_url_white: str, the URL of the White Lichess study
     :param study_url_black: str, the URL of the Black Lichess study
     :param max_games: int, the number of games to look at the user's history
+    :param force_refresh: bool, whether to discard cached results first. Defaults to False.
+    :param fast_ingest: bool, whether to read the games from the NDJSON export. Defaults to False.
+    :param filters: GameFilters, the filters on the user's games. Defaults to None.
     :return: None
     """
+    if force_refresh:
+        LOG.info("Clearing cached fetches and analyses for %s", username)
+        clear_caches(
+            username,
+            study_url_white,
+            study_url_black,
+            max_games,
+            fast_ingest,
+            filters,
+        )
 
-    # Fetch the last game played by the user
-    test_game_str = get_last_games_pgn(username, max_games)
-    if test_game_str is None:
-        print("Error fetching games!")
-    else:
-        test_game_list = pgn_utils.pgn_to_pgn_list(test_game_str)
-        white_study = lichess_api.Study.fetch_url(study_url_white)
-        black_study = lichess_api.Study.fetch_url(study_url_black)
-        # Find deviation between games
-        info_list = []
-        for game in test_game_list:
-            deviation_info = find_deviation_in_entire_study_white_and_black(
-                white_study, black_study, game, username
-            )
-            info_list.append(deviation_info)
-        grid = get_image_grid_from_deviation_list(info_list)
-        display_image_grid(grid)
+    try:
+        info_list = analyze_games_cached(
+            username,
+            study_url_white,
+            study_url_black,
+            max_games,
+            fast_ingest,
+            filters,
+        )
+    except GamesFetchError as e:
+        LOG.error(e)
+        st.error(str(e))
+        return
+    if not info_list:
+        st.warning("No games matched the filters")
+        return
+    display_compact_grid(info_list)
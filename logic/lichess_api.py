@@ -3,9 +3,11 @@ This module handles requests to the Lichess API to get the last games from a use
 and get study data from a Lichess study.
 """
 
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, Mapping, Optional
 import chess.pgn
 import dataclasses
+import datetime
 import re
 import requests
 from requests.adapters import HTTPAdapter
@@ -14,6 +16,12 @@ from . import pgn_utils
 from streamlit.logger import get_logger
 LOG = get_logger(__name__)
 
+# The games export endpoint accepts at most this many IDs per request
+MAX_IDS_PER_EXPORT = 300
+
+# The performance types of standard chess games, as named by the games export endpoint
+STANDARD_PERF_TYPES = ("ultraBullet", "bullet", "blitz", "rapid", "classical", "correspondence")
+
 
 @dataclasses.dataclass
 class Study:
@@ -35,12 +43,74 @@ class Study:
         return study
 
 
+@dataclasses.dataclass(frozen=True)
+class GameFilters:
+    """
+    Filters on the games of a user, sent to the games export endpoint where it supports them.
+
+    Attributes:
+        color (str): Only keep games where the user played this color ("white" or "black").
+        rated_only (bool): Only keep rated games.
+        perf_types (tuple[str, ...]): Only keep games of these performance types, like "blitz".
+            Defaults to every standard chess performance type, which leaves out the variants.
+        since (datetime.date): Only keep games played on or after this day (UTC).
+        until (datetime.date): Only keep games played on or before this day (UTC).
+        strip_annotations (bool): Leave clocks, evals and comments out of the export.
+    """
+
+    color: Optional[str] = None
+    rated_only: bool = False
+    perf_types: tuple[str, ...] = ()
+    since: Optional[datetime.date] = None
+    until: Optional[datetime.date] = None
+    strip_annotations: bool = True
+
+    def to_params(self) -> dict[str, str]:
+        """
+        Converts the filters into query parameters of the games export endpoint.
+
+        :return: dict[str, str], the query parameters
+        """
+        params = {}
+        if self.color is not None:
+            params["color"] = self.color
+        if self.rated_only:
+            params["rated"] = "true"
+        # Variants have their own performance types, so this also filters out variant games
+        params["perfType"] = ",".join(self.perf_types or STANDARD_PERF_TYPES)
+        if self.since is not None:
+            params["since"] = str(_day_start_millis(self.since))
+        if self.until is not None:
+            params["until"] = str(_day_start_millis(self.until + datetime.timedelta(days=1)) - 1)
+        if self.strip_annotations:
+            params.update(clocks="false", evals="false", literate="false")
+        return params
+
+    def matches(self, headers: Mapping[str, str], username: str) -> bool:
+        """
+        Applies the filters the endpoint cannot, using only the headers of a game.
+
+        The variant is already filtered by the endpoint through the performance types, and is
+        only checked here as a fallback. Games the user did not play in are dropped too,
+        comparing usernames case-insensitively like Lichess does.
+
+        :param headers: Mapping[str, str], the headers of the game
+        :param username: str, the Lichess username of the player
+        :return: bool, True if the game should be kept
+        """
+        if headers.get("Variant", "Standard") != "Standard":
+            return False
+        players = (headers.get("White", ""), headers.get("Black", ""))
+        return username.lower() in (player.lower() for player in players)
+
+
 def get_last_games_pgn(
     username: str,
     max_games: int = 1,
     retries: int = 3,
     backoff_factor: float = 1.5,
     timeout: int = 10,
+    filters: Optional[GameFilters] = None,
 ) -> Optional[str]:
     """
     Fetches the PGN of the last several games played by a Lichess username with retry and timeout.
@@ -50,24 +120,16 @@ def get_last_games_pgn(
     :param retries: int, the number of retries in case of failures (default is 3)
     :param backoff_factor: float, the backoff factor for retrying requests (default is 1.5)
     :param timeout: int, the timeout for each HTTP request in seconds (default is 10)
+    :param filters: GameFilters, the filters to send to the endpoint (default is None)
     :return: Optional[str], the PGN of the last game(s) played by the user, or None if failed
     """
-    session = requests.Session()
-    retry = Retry(
-        total=retries,
-        read=retries,
-        connect=retries,
-        backoff_factor=backoff_factor,
-        status_forcelist=(500, 502, 504),
-    )
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount("https://", adapter)
+    session = _make_session(retries, backoff_factor)
     LOG.info("Fetching %s games for %s", max_games, username)
 
     try:
         response = session.get(
             f"https://lichess.org/api/games/user/{username}",
-            params={"max": max_games},
+            params={"max": max_games, **(filters.to_params() if filters else {})},
             timeout=timeout,
         )
         # Will raise an HTTPError if the HTTP request returned an unsuccessful status code
@@ -79,6 +141,189 @@ def get_last_games_pgn(
         return None
 
 
+def get_last_games_ndjson(
+    username: str,
+    max_games: int = 1,
+    retries: int = 3,
+    backoff_factor: float = 1.5,
+    timeout: int = 10,
+    filters: Optional[GameFilters] = None,
+) -> Optional[Iterator[str]]:
+    """
+    Streams the last several games played by a Lichess username as NDJSON, one game per line.
+
+    Only the players, game ID and SAN move list are needed from each game, so clocks, evals and
+    opening names are left out of the export.
+
+    :param username: str, the Lichess username of the player
+    :param max_games: int, the maximum number of games to retrieve (default is 1)
+    :param retries: int, the number of retries in case of failures (default is 3)
+    :param backoff_factor: float, the backoff factor for retrying requests (default is 1.5)
+    :param timeout: int, the timeout for each HTTP request in seconds (default is 10)
+    :param filters: GameFilters, the filters to send to the endpoint (default is None)
+    :return: Optional[Iterator[str]], the lines of the export as they arrive, or None if failed.
+        The connection is closed once the lines are exhausted, and a requests exception is
+        raised from the iteration if the stream breaks off
+    """
+    session = _make_session(retries, backoff_factor)
+    LOG.info("Streaming %s games for %s", max_games, username)
+
+    try:
+        response = session.get(
+            f"https://lichess.org/api/games/user/{username}",
+            params={
+                "max": max_games,
+                "moves": "true",
+                "clocks": "false",
+                "evals": "false",
+                "opening": "false",
+                **(filters.to_params() if filters else {}),
+            },
+            headers={"Accept": "application/x-ndjson"},
+            timeout=timeout,
+            stream=True,
+        )
+        # Will raise an HTTPError if the HTTP request returned an unsuccessful status code
+        response.raise_for_status()
+        # The export has no charset in its content type, so lines would be bytes otherwise
+        response.encoding = "utf-8"
+    except requests.exceptions.RequestException as e:
+        print(f"An error occurred: {e}")
+        session.close()
+        return None
+
+    def iter_lines() -> Iterator[str]:
+        try:
+            yield from response.iter_lines(decode_unicode=True)
+        finally:
+            response.close()
+            session.close()
+
+    return iter_lines()
+
+
+def get_games_pgn_by_ids(
+    game_ids: Iterable[str],
+    batch_size: int = MAX_IDS_PER_EXPORT,
+    max_workers: int = 1,
+    retries: int = 3,
+    backoff_factor: float = 1.5,
+    timeout: int = 30,
+) -> Iterator[Optional[str]]:
+    """
+    Fetches the PGN of specific games through the bulk export endpoint, in batches of IDs.
+
+    Batches are requested up to max_workers at a time, and yielded in the order of the given
+    IDs as soon as each one is available. Lichess rate-limits parallel requests, so rate-limited
+    requests are retried after the delay it asks for. A batch that still fails is yielded as
+    None, so that the batches after it are still fetched.
+
+    :param game_ids: Iterable[str], Lichess game IDs or game URLs
+    :param batch_size: int, the number of IDs per request (default and maximum is 300)
+    :param max_workers: int, the maximum number of requests in flight (default is 1)
+    :param retries: int, the number of retries in case of failures (default is 3)
+    :param backoff_factor: float, the backoff factor for retrying requests (default is 1.5)
+    :param timeout: int, the timeout for each HTTP request in seconds (default is 30)
+    :return: Iterator[Optional[str]], the PGN of each batch of games, or None if it failed
+    """
+    if not 1 <= batch_size <= MAX_IDS_PER_EXPORT:
+        raise ValueError(
+            f"batch_size must be between 1 and {MAX_IDS_PER_EXPORT}, got {batch_size}"
+        )
+    # Deduplicate while keeping the requested order
+    ids = list(dict.fromkeys(_extract_game_id_from_url(game_id) for game_id in game_ids))
+    batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+    session = _make_session(
+        retries,
+        backoff_factor,
+        allowed_methods=["POST"],
+        status_forcelist=(429, 500, 502, 504),
+    )
+    LOG.info("Fetching %s games in %s batches", len(ids), len(batches))
+
+    def fetch_batch(batch: list[str]) -> Optional[str]:
+        try:
+            response = session.post(
+                "https://lichess.org/api/games/export/_ids",
+                data=",".join(batch),
+                timeout=timeout,
+            )
+            # Will raise an HTTPError if the HTTP request returned an unsuccessful status code
+            response.raise_for_status()
+            return response.text
+        except requests.exceptions.RequestException as e:
+            LOG.error("Failed to fetch games %s: %s", ",".join(batch), e)
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        yield from executor.map(fetch_batch, batches)
+    LOG.info("Fetch done")
+
+
+def _make_session(
+    retries: int,
+    backoff_factor: float,
+    allowed_methods: Optional[list[str]] = None,
+    status_forcelist: tuple[int, ...] = (500, 502, 504),
+) -> requests.Session:
+    """
+    Creates a requests session that retries failed Lichess requests with backoff.
+
+    :param retries: int, the number of retries in case of failures
+    :param backoff_factor: float, the backoff factor for retrying requests
+    :param allowed_methods: list[str], the HTTP methods to retry, or None for urllib3's default
+    :param status_forcelist: tuple[int, ...], the HTTP status codes to retry. A Retry-After
+        header on them is honoured (default is 500, 502 and 504)
+    :return: requests.Session, the configured session
+    """
+    session = requests.Session()
+    retry_kwargs = {}
+    if allowed_methods is not None:
+        retry_kwargs["allowed_methods"] = allowed_methods
+    retry = Retry(
+        total=retries,
+        read=retries,
+        connect=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=status_forcelist,
+        **retry_kwargs,
+    )
+    adapter = HTTPAdapter(max_retries=retry)
+    session.mount("https://", adapter)
+    return session
+
+
+def _day_start_millis(day: datetime.date) -> int:
+    """
+    Converts a day into the timestamp of its start in UTC, in milliseconds as used by Lichess.
+
+    :param day: datetime.date, the day
+    :return: int, the number of milliseconds since the epoch at midnight UTC of that day
+    """
+    start = datetime.datetime.combine(day, datetime.time(), tzinfo=datetime.timezone.utc)
+    return int(start.timestamp() * 1000)
+
+
+def _extract_game_id_from_url(url: str) -> str:
+    """
+    Extracts the game ID from a Lichess game URL, or passes a bare game ID through.
+
+    :param url: str, the URL of the Lichess game, or its ID
+    :return: str, the 8-character game ID
+    """
+    # Game URLs may carry a player suffix (/black) or a move anchor (#12), and the
+    # 12-character IDs seen by each player start with the 8-character game ID
+    pattern = re.compile(
+        r"^(?:https?://)?(?:lichess\.org/)?([a-zA-Z0-9]{8})(?:[a-zA-Z0-9]{4})?(?:[/#?].*)?$"
+    )
+    match = pattern.match(url.strip())
+
+    if match:
+        return match.group(1)
+
+    raise ValueError(f"Could not find a Lichess game ID in {url!r}")
+
+
 def _extract_study_id_from_url(url: str) -> str:
     """
     Extracts the study ID from a Lichess study URL.
@@ -0,0 +1,106 @@
+"""
+This module provides utility functions for games exported by Lichess as NDJSON.
+"""
+
+import dataclasses
+import json
+from typing import Iterable, Iterator
+import chess
+import chess.pgn
+
+# The names of the variants in the export, as they appear in the PGN headers
+_VARIANT_NAMES = {
+    "standard": "Standard",
+    "chess960": "Chess960",
+    "crazyhouse": "Crazyhouse",
+    "antichess": "Antichess",
+    "atomic": "Atomic",
+    "horde": "Horde",
+    "kingOfTheHill": "King of the Hill",
+    "racingKings": "Racing Kings",
+    "threeCheck": "Three-check",
+    "fromPosition": "From Position",
+}
+
+
+@dataclasses.dataclass
+class ExportedGame:
+    """
+    A lightweight game read from one line of the Lichess NDJSON export.
+
+    It provides the part of the chess.pgn.Game interface used to find deviations
+    (headers, board and mainline_moves) without building a tree of game nodes.
+    Moves are converted from SAN lazily, so only the moves that are compared get parsed.
+    """
+
+    game_id: str
+    headers: chess.pgn.Headers
+    moves_san: list[str]
+
+    def board(self) -> chess.Board:
+        """
+        Gets the starting position of the game, like chess.pgn.Game.board.
+
+        :return: chess.Board, the board of the game's variant, from its FEN if it has one
+        """
+        return self.headers.board()
+
+    def mainline_moves(self) -> Iterator[chess.Move]:
+        """
+        Gets the moves of the game, like chess.pgn.Game.mainline_moves.
+
+        :return: Iterator[chess.Move], the moves of the game in order, parsed as they are reached
+        """
+        board = self.board()
+        for san in self.moves_san:
+            yield board.push_san(san)
+
+
+def ndjson_line_to_game(line: str) -> ExportedGame:
+    """
+    Converts one line of the Lichess NDJSON game export into an ExportedGame.
+
+    :param line: str, a JSON object describing a single game
+    :return: ExportedGame, the game object
+    """
+    data = json.loads(line)
+    players = data.get("players", {})
+    game_id = data["id"]
+    variant = data.get("variant", "standard")
+    headers = chess.pgn.Headers(
+        Site=f"https://lichess.org/{game_id}",
+        White=_player_name(players.get("white", {})),
+        Black=_player_name(players.get("black", {})),
+        Variant=_VARIANT_NAMES.get(variant, variant),
+    )
+    if "initialFen" in data:
+        headers["FEN"] = data["initialFen"]
+        headers["SetUp"] = "1"
+    return ExportedGame(
+        game_id=game_id,
+        headers=headers,
+        moves_san=data.get("moves", "").split(),
+    )
+
+
+def ndjson_to_game_list(lines: Iterable[str]) -> list[ExportedGame]:
+    """
+    Reads the games of a Lichess NDJSON export, one per non-empty line.
+
+    :param lines: Iterable[str], the lines of the export, possibly streamed
+    :return: List[ExportedGame], the games read from the export
+    """
+    return [ndjson_line_to_game(line) for line in lines if line.strip()]
+
+
+def _player_name(player: dict) -> str:
+    """
+    Gets the name of a player in the export, the same way it appears in the PGN headers.
+
+    :param player: dict, the player object of the export
+    :return: str, the player's username, or "?" for anonymous players and the computer
+    """
+    user = player.get("user")
+    if user is None:
+        return "?"
+    return user["name"]
@@ -4,6 +4,7 @@ This module provides utility functions for pgn files.
 
 import chess.pgn
 import io
+from typing import Callable, Optional
 
 
 def pgn_string_to_game(pgn_str: str) -> chess.pgn.Game:
@@ -20,12 +21,25 @@ def pgn_string_to_game(pgn_str: str) -> chess.pgn.Game:
     return game
 
 
-def pgn_to_pgn_list(pgn_data: str) -> list[chess.pgn.Game]:
+def pgn_to_pgn_list(
+    pgn_data: str,
+    header_filter: Optional[Callable[[chess.pgn.Headers], bool]] = None,
+) -> list[chess.pgn.Game]:
     """
     Splits a pgn with multiple games into a list of pgns with one game each
 
     :param pgn_data: str, a PGN string, possibly containing many games, separated by 3 new lines each
-    :return: List[chess.pgn.Game], a list of chess game objects read in from the PGN string
+    :param header_filter: Callable, if given, only the games whose headers it accepts are kept.
+        The headers are checked before the moves of a game are parsed.
+    :return: List[chess.pgn.Game], a list of chess game objects read in from the PGN string.
+        It is empty if the PGN string has no games, like an export that matched nothing.
     """
-    pgn_list_str = pgn_data.strip().split("\n\n\n")
+    pgn_list_str = [game for game in pgn_data.strip().split("\n\n\n") if game.strip()]
+    if header_filter is not None:
+        pgn_list_str = [
+            game
+            for game in pgn_list_str
+            if (headers := chess.pgn.read_headers(io.StringIO(game))) is not None
+            and header_filter(headers)
+        ]
     return [pgn_string_to_game(game) for game in pgn_list_str]
@@ -4,6 +4,7 @@ This is the driver code that actually displays the website through streamlit.
 
 import streamlit as st
 from logic.form_handlers import handle_form_submission_grid
+from logic.lichess_api import STANDARD_PERF_TYPES, GameFilters
 
 # Title of the web app
 st.title("Chess Opening Repertoire Practice")
@@ -37,11 +38,46 @@ with st.form(key="opening_form"):
             value=DEFAULT_BLACK_STUDY,
         )
 
+    # Filters on the games to fetch, sent to Lichess where possible
+    with st.expander("Filter games"):
+        col5, col6 = st.columns(2)
+        with col5:
+            color = st.selectbox(label="Color", options=["Both", "White", "Black"])
+            perf_types = st.multiselect(
+                label="Time controls (all if empty)", options=STANDARD_PERF_TYPES
+            )
+        with col6:
+            date_range = st.date_input(label="Played between", value=())
+            rated_only = st.checkbox(label="Rated games only")
+            strip_annotations = st.checkbox(
+                label="Leave out clocks, evals and comments", value=True
+            )
+
+    # Cached results are reused for repeated submissions unless a refresh is requested
+    force_refresh = st.checkbox(label="Refresh cached games, studies and results")
+    fast_ingest = st.checkbox(
+        label="Fast ingestion (only read the opening moves of each game)"
+    )
+
     # Submit button in its own row to span across the form
     submit_button = st.form_submit_button(label="Submit (this will be SLOW)")
 
 # Handling form submission
 if submit_button:
+    filters = GameFilters(
+        color=None if color == "Both" else color.lower(),
+        rated_only=rated_only,
+        perf_types=tuple(perf_types),
+        since=date_range[0] if len(date_range) > 0 else None,
+        until=date_range[1] if len(date_range) > 1 else None,
+        strip_annotations=strip_annotations,
+    )
     handle_form_submission_grid(
-        username, study_url_white, study_url_black, int(max_games)
+        username,
+        study_url_white,
+        study_url_black,
+        int(max_games),
+        force_refresh=force_refresh,
+        fast_ingest=fast_ingest,
+        filters=filters,
     )
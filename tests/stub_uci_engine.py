@@ -0,0 +1,41 @@
+"""
+A trivial UCI engine for tests. It scores a move as 10 centipawns per rank of its target
+square, and logs every search to the file named by STUB_ENGINE_LOG. Each search takes
+STUB_ENGINE_DELAY seconds, and searching a2a3 crashes the engine.
+"""
+
+import os
+import sys
+import time
+
+
+def main():
+    search_moves = []
+    for line in sys.stdin:
+        tokens = line.split()
+        if not tokens:
+            continue
+        if tokens[0] == "uci":
+            print("id name Stub")
+            print("uciok")
+        elif tokens[0] == "isready":
+            print("readyok")
+        elif tokens[0] == "go":
+            search_moves = tokens[tokens.index("searchmoves") + 1:] if "searchmoves" in tokens else ["e2e4"]
+            move = search_moves[0]
+            log_path = os.environ.get("STUB_ENGINE_LOG")
+            if log_path:
+                with open(log_path, "a", encoding="utf-8") as log:
+                    log.write(f"{move}\n")
+            if move == "a2a3":
+                sys.exit(1)
+            time.sleep(float(os.environ.get("STUB_ENGINE_DELAY", "0")))
+            print(f"info depth 1 score cp {10 * int(move[3])} pv {move}")
+            print(f"bestmove {move}")
+        elif tokens[0] == "quit":
+            break
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,15 @@
 import pytest
 from logic.chess_utils import (
     find_deviation,
+    find_book_exit,
+    find_book_exit_in_chapters,
     read_pgn,
     get_player_color,
     find_deviation_in_entire_study)
 
 from logic import lichess_api
-from logic.deviation_result import DeviationResult
+from logic.pgn_utils import pgn_string_to_game
+from logic.deviation_result import BookExit, DeviationResult
 
 PGN_PATH = "pgns/"
 
@@ -65,6 +68,81 @@ def test_find_deviation(ref_pgn_path, my_pgn_path, player, expected):
     assert find_deviation(ref_game, my_game, player) == expected
 
 
+@pytest.mark.parametrize(
+    "ref_pgn_path, my_pgn_path, player, expected",
+    [
+        (
+            "ref-acc-dragon-1.pgn",
+            "a5-should-be-Re8-jrjrjr4.pgn",
+            "Jrjrjr4",
+            BookExit(16, "a5", ["Re8"], "Black", True),
+        ),
+        (
+            "acc-dragon-test-1.pgn",
+            "opponent-deviates-first.pgn",
+            "Jrjrjr4",
+            BookExit(3, "Nc3", ["Nf3"], "White", False),
+        ),
+        (
+            "carlsen-nakamura-2018.pgn",
+            "carlsen-nakamura-2018.pgn",
+            "Carlsen, M.",
+            None,
+        ),
+    ],
+)
+def test_find_book_exit(ref_pgn_path, my_pgn_path, player, expected):
+    ref_game = read_pgn(PGN_PATH + ref_pgn_path)
+    my_game = read_pgn(PGN_PATH + my_pgn_path)
+    assert find_book_exit(ref_game, my_game, player) == expected
+
+
+def test_find_book_exit_in_chapters_prefers_player_deviation():
+    chapters = [
+        read_pgn(PGN_PATH + "acc-dragon-test-1.pgn"),
+        read_pgn(PGN_PATH + "ref-acc-dragon-1.pgn"),
+    ]
+    my_game = read_pgn(PGN_PATH + "a5-should-be-Re8-jrjrjr4.pgn")
+    book_exit = find_book_exit_in_chapters(chapters, my_game, "Jrjrjr4")
+    assert book_exit == BookExit(16, "a5", ["Re8"], "Black", True)
+    assert book_exit.to_deviation_result() == DeviationResult(8, "a5", "Re8", "Black")
+
+
+def test_find_book_exit_in_chapters_returns_deepest_opponent_exit():
+    # The opponent leaves the first chapter at 2.Nf3 and the second one later, at 7.Be2
+    chapters = [
+        read_pgn(PGN_PATH + "opponent-deviates-first.pgn"),
+        read_pgn(PGN_PATH + "acc-dragon-test-1.pgn"),
+    ]
+    my_game = read_pgn(PGN_PATH + "jrjrjr4-last-game.pgn")
+    assert find_book_exit_in_chapters(chapters, my_game, "Jrjrjr4") == BookExit(
+        13, "Be2", ["Bc4"], "White", False
+    )
+
+
+def test_find_book_exit_in_chapters_merges_expected_moves_at_same_ply():
+    # Both chapters expect 2.Nf3 where the game has 2.Nc3; a third expects 2.c3
+    chapters = [
+        read_pgn(PGN_PATH + "acc-dragon-test-1.pgn"),
+        read_pgn(PGN_PATH + "ref-acc-dragon-1.pgn"),
+        pgn_string_to_game("1. e4 c5 2. c3"),
+    ]
+    my_game = read_pgn(PGN_PATH + "opponent-deviates-first.pgn")
+    assert find_book_exit_in_chapters(chapters, my_game, "Jrjrjr4") == BookExit(
+        3, "Nc3", ["Nf3", "c3"], "White", False
+    )
+
+
+def test_find_book_exit_in_chapters_stays_in_book():
+    # The opponent leaves the first chapter, but the game follows the second one to its end
+    chapters = [
+        read_pgn(PGN_PATH + "opponent-deviates-first.pgn"),
+        read_pgn(PGN_PATH + "acc-dragon-test-1.pgn"),
+    ]
+    my_game = read_pgn(PGN_PATH + "acc-dragon-test-1.pgn")
+    assert find_book_exit_in_chapters(chapters, my_game, "Goumas, G.") is None
+
+
 @pytest.mark.parametrize(
     "my_pgn_path, player, expected",
     [
@@ -0,0 +1,101 @@
+import sys
+import chess
+import chess.engine
+import pytest
+import cli
+from logic.chess_utils import find_deviation, read_pgn
+from logic.deviation_result import DeviationResult
+from logic.engine_eval import EnginePool
+
+PGN_PATH = "pgns/"
+STUB_ENGINE = [sys.executable, "tests/stub_uci_engine.py"]
+
+
+@pytest.fixture
+def engine_log(tmp_path, monkeypatch):
+    log_path = tmp_path / "searches.log"
+    monkeypatch.setenv("STUB_ENGINE_LOG", str(log_path))
+    return log_path
+
+
+def searches(log_path):
+    return log_path.read_text().split() if log_path.exists() else []
+
+
+def test_evaluate_move_is_cached_on_disk(tmp_path, engine_log):
+    cache_path = str(tmp_path / "cache.sqlite3")
+    board = chess.Board()
+    with EnginePool(STUB_ENGINE, size=1, depth=1, cache_path=cache_path) as pool:
+        assert pool.evaluate_move(board, chess.Move.from_uci("e2e4")) == 40
+        assert pool.evaluate_move(board, chess.Move.from_uci("e2e4")) == 40
+    with EnginePool(STUB_ENGINE, size=1, depth=1, cache_path=cache_path) as pool:
+        assert pool.evaluate_move(board, chess.Move.from_uci("e2e4")) == 40
+        assert pool.evaluate_move(board, chess.Move.from_uci("d2d3")) == 30
+    assert searches(engine_log) == ["e2e4", "d2d3"]
+
+
+def test_evaluate_move_cache_depends_on_depth(tmp_path, engine_log):
+    cache_path = str(tmp_path / "cache.sqlite3")
+    board = chess.Board()
+    for depth in (1, 2):
+        with EnginePool(STUB_ENGINE, size=1, depth=depth, cache_path=cache_path) as pool:
+            pool.evaluate_move(board, chess.Move.from_uci("e2e4"))
+    assert searches(engine_log) == ["e2e4", "e2e4"]
+
+
+def test_evaluate_deviations(tmp_path, engine_log):
+    deviation = find_deviation(
+        read_pgn(PGN_PATH + "ref-acc-dragon-1.pgn"),
+        read_pgn(PGN_PATH + "a5-should-be-Re8-jrjrjr4.pgn"),
+        "Jrjrjr4",
+    )
+    with EnginePool(STUB_ENGINE, size=2, depth=1, cache_path=str(tmp_path / "c")) as pool:
+        evaluations = pool.evaluate_deviations([deviation, None, deviation])
+    assert evaluations[1] is None
+    # a7a5 lands on rank 5 and f8e8 on rank 8
+    assert (evaluations[0].deviation_cp, evaluations[0].reference_cp) == (50, 80)
+    assert evaluations[2].loss_cp == 30
+
+
+def test_evaluate_move_cache_ignores_move_counters(tmp_path, engine_log):
+    board = chess.Board()
+    later_board = chess.Board("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 4 3")
+    with EnginePool(STUB_ENGINE, size=1, depth=1, cache_path=str(tmp_path / "c")) as pool:
+        pool.evaluate_move(board, chess.Move.from_uci("e2e4"))
+        pool.evaluate_move(later_board, chess.Move.from_uci("e2e4"))
+    assert searches(engine_log) == ["e2e4"]
+
+
+def test_evaluate_deviations_searches_duplicates_once(tmp_path, engine_log, monkeypatch):
+    monkeypatch.setenv("STUB_ENGINE_DELAY", "0.2")
+    deviation = find_deviation(
+        read_pgn(PGN_PATH + "ref-acc-dragon-1.pgn"),
+        read_pgn(PGN_PATH + "a5-should-be-Re8-jrjrjr4.pgn"),
+        "Jrjrjr4",
+    )
+    with EnginePool(STUB_ENGINE, size=4, depth=1, cache_path=str(tmp_path / "c")) as pool:
+        evaluations = pool.evaluate_deviations([deviation] * 8)
+    assert all(evaluation.loss_cp == 30 for evaluation in evaluations)
+    assert sorted(searches(engine_log)) == ["a7a5", "f8e8"]
+
+
+def test_crashed_engine_is_replaced(tmp_path, engine_log):
+    board = chess.Board()
+    with EnginePool(STUB_ENGINE, size=1, depth=1, cache_path=str(tmp_path / "c")) as pool:
+        with pytest.raises(chess.engine.EngineError):
+            pool.evaluate_move(board, chess.Move.from_uci("a2a3"))
+        assert pool.evaluate_move(board, chess.Move.from_uci("e2e4")) == 40
+    assert searches(engine_log) == ["a2a3", "e2e4"]
+
+
+def test_cli_reports_engine_errors_and_keeps_going(tmp_path, engine_log, capsys):
+    # The stub engine crashes on a2a3
+    crashing = DeviationResult(1, "a3", "e4", "White")
+    deviation = DeviationResult(1, "d3", "e4", "White")
+    with EnginePool(STUB_ENGINE, size=1, depth=1, cache_path=str(tmp_path / "c")) as pool:
+        evaluations = cli.evaluate_deviations(
+            pool, ["game0000", "game0001", "game0002"], [crashing, None, deviation]
+        )
+    assert evaluations[:2] == [None, None]
+    assert evaluations[2].loss_cp == 10
+    assert "game0000: not evaluated" in capsys.readouterr().err
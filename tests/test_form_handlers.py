@@ -0,0 +1,75 @@
+import re
+from unittest import mock
+import pytest
+import requests
+from logic.chess_utils import find_deviation, read_pgn
+from logic.form_handlers import (
+    GamesFetchError,
+    analyze_games_cached,
+    get_board_svg_with_arrows,
+    get_compact_grid_html,
+    handle_form_submission_grid,
+)
+
+PGN_PATH = "pgns/"
+
+
+def test_get_compact_grid_html_shares_definitions():
+    deviation = find_deviation(
+        read_pgn(PGN_PATH + "ref-acc-dragon-1.pgn"),
+        read_pgn(PGN_PATH + "a5-should-be-Re8-jrjrjr4.pgn"),
+        "Jrjrjr4",
+    )
+    deviation_list = [deviation, None] * 10
+    html = get_compact_grid_html(deviation_list)
+
+    assert html.count('id="black-king"') == 1
+    assert html.count('href="#board-frame-black"') == 10
+    assert html.count('href="#board-frame-white"') == 10
+    assert html.count('<use href="#black-king"') == 10
+    assert html.count('class="arrow"') == 40
+    standalone = get_board_svg_with_arrows(
+        deviation.board, deviation.reference_san, deviation.deviation_san, deviation.player_color
+    )
+    assert len(html) * 4 < len(standalone) * len(deviation_list)
+
+
+def test_get_compact_grid_html_matches_chess_svg_layout():
+    deviation = find_deviation(
+        read_pgn(PGN_PATH + "ref-acc-dragon-1.pgn"),
+        read_pgn(PGN_PATH + "a5-should-be-Re8-jrjrjr4.pgn"),
+        "Jrjrjr4",
+    )
+    html = get_compact_grid_html([deviation])
+    standalone = get_board_svg_with_arrows(
+        deviation.board, deviation.reference_san, deviation.deviation_san, deviation.player_color
+    )
+
+    def pieces(svg):
+        return sorted(re.findall(r'<use href="(#[a-z]+-[a-z]+)"[^>]* transform="([^"]*)"', svg))
+
+    def arrow_points(svg):
+        return [
+            [round(float(number)) for number in re.findall(r"[0-9.]+", points)]
+            for points in re.findall(r'<polygon points="([^"]*)"', svg)
+        ]
+
+    assert pieces(html) == pieces(standalone)
+    assert arrow_points(html) == arrow_points(standalone)
+
+
+def test_analyze_games_cached_reports_broken_stream():
+    def broken_lines():
+        raise requests.exceptions.ChunkedEncodingError("connection reset")
+        yield
+
+    with mock.patch("logic.lichess_api.get_last_games_ndjson", return_value=broken_lines()):
+        with pytest.raises(GamesFetchError):
+            analyze_games_cached("Jrjrjr4", "white", "black", 10, fast_ingest=True)
+
+
+def test_handle_form_submission_grid_reports_no_games():
+    with mock.patch("logic.form_handlers.analyze_games_cached", return_value=[]), \
+            mock.patch("streamlit.warning") as warning:
+        handle_form_submission_grid("jrjrjr4", "white", "black", 10)
+    warning.assert_called_once_with("No games matched the filters")
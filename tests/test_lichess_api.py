@@ -1,5 +1,15 @@
+import datetime
+import io
+import pathlib
 import pytest
-from logic.lichess_api import _extract_study_id_from_url
+import requests
+import urllib3
+from unittest import mock
+from logic import lichess_api, pgn_utils
+from logic.lichess_api import (
+    _extract_game_id_from_url,
+    _extract_study_id_from_url,
+)
 
 
 @pytest.mark.parametrize(
@@ -12,3 +22,138 @@ from logic.lichess_api import _extract_study_id_from_url
 )
 def test_extract_study_id_from_url_using_chapter(input_url, expected_output):
     assert _extract_study_id_from_url(input_url) == expected_output
+
+
+@pytest.mark.parametrize(
+    "input_url, expected_output",
+    [
+        ("EE8nALl4", "EE8nALl4"),
+        ("https://lichess.org/EE8nALl4", "EE8nALl4"),
+        ("https://lichess.org/EE8nALl4/black", "EE8nALl4"),
+        ("https://lichess.org/EE8nALl4abcd", "EE8nALl4"),
+        ("lichess.org/EE8nALl4#12", "EE8nALl4"),
+    ],
+)
+def test_extract_game_id_from_url(input_url, expected_output):
+    assert _extract_game_id_from_url(input_url) == expected_output
+
+
+def test_extract_game_id_from_url_rejects_study():
+    with pytest.raises(ValueError):
+        _extract_game_id_from_url("https://lichess.org/study/RKEBYTWL")
+
+
+def test_get_games_pgn_by_ids_batches_ids():
+    ids = [f"game{i:04d}" for i in range(5)]
+    response = mock.Mock(text="pgn")
+    with mock.patch("requests.Session.post", return_value=response) as post:
+        pgns = list(
+            lichess_api.get_games_pgn_by_ids(ids + ids[:1], batch_size=2)
+        )
+    assert pgns == ["pgn", "pgn", "pgn"]
+    bodies = sorted(call.kwargs["data"] for call in post.call_args_list)
+    assert bodies == ["game0000,game0001", "game0002,game0003", "game0004"]
+
+
+def test_game_filters_to_params():
+    filters = lichess_api.GameFilters(
+        color="black",
+        rated_only=True,
+        perf_types=("blitz", "rapid"),
+        since=datetime.date(2024, 2, 22),
+        until=datetime.date(2024, 2, 22),
+    )
+    assert filters.to_params() == {
+        "color": "black",
+        "rated": "true",
+        "perfType": "blitz,rapid",
+        "since": "1708560000000",
+        "until": "1708646399999",
+        "clocks": "false",
+        "evals": "false",
+        "literate": "false",
+    }
+    assert lichess_api.GameFilters(strip_annotations=False).to_params() == {
+        "perfType": "ultraBullet,bullet,blitz,rapid,classical,correspondence",
+    }
+
+
+def test_game_filters_apply_on_headers_before_parsing():
+    games = [
+        pathlib.Path("pgns", path).read_text(encoding="utf-8").strip()
+        for path in ("jrjrjr4-last-game.pgn", "harpseal-rayrey784.pgn")
+    ]
+    chess960 = games[0].replace('[Variant "Standard"]', '[Variant "Chess960"]')
+    filters = lichess_api.GameFilters()
+    kept = pgn_utils.pgn_to_pgn_list(
+        "\n\n\n".join(games + [chess960]),
+        lambda headers: filters.matches(headers, "Jrjrjr4"),
+    )
+    assert [game.headers["Black"] for game in kept] == ["Jrjrjr4"]
+
+
+def test_game_filters_match_username_case_insensitively():
+    headers = {"White": "HarpSeal", "Black": "Jrjrjr4"}
+    assert lichess_api.GameFilters().matches(headers, "jrjrjr4")
+    assert not lichess_api.GameFilters().matches(headers, "jrjrjr")
+
+
+def test_game_filters_on_empty_export():
+    filters = lichess_api.GameFilters()
+    assert pgn_utils.pgn_to_pgn_list("\n", lambda headers: filters.matches(headers, "Jrjrjr4")) == []
+
+
+def test_get_games_pgn_by_ids_skips_failed_batch():
+    failed = mock.Mock()
+    failed.raise_for_status.side_effect = requests.exceptions.HTTPError("429")
+    ok = mock.Mock(text="pgn")
+    with mock.patch("requests.Session.post", side_effect=[failed, ok]):
+        pgns = list(
+            lichess_api.get_games_pgn_by_ids(["game0000", "game0001"], batch_size=1)
+        )
+    assert pgns == [None, "pgn"]
+
+
+def test_get_games_pgn_by_ids_retries_rate_limits():
+    # Lichess answers 429 with a Retry-After header; the batch must still be delivered
+    responses = [
+        urllib3.HTTPResponse(
+            body=io.BytesIO(b""),
+            status=429,
+            headers={"Retry-After": "0"},
+            preload_content=False,
+        ),
+        urllib3.HTTPResponse(
+            body=io.BytesIO(b"pgn"), status=200, preload_content=False
+        ),
+    ]
+    with mock.patch(
+        "urllib3.connectionpool.HTTPSConnectionPool._make_request",
+        side_effect=responses,
+    ) as make_request:
+        pgns = list(lichess_api.get_games_pgn_by_ids(["game0000"]))
+    assert pgns == ["pgn"]
+    assert make_request.call_count == 2
+
+
+def test_get_last_games_ndjson_closes_stream():
+    response = mock.Mock()
+    response.iter_lines.return_value = iter(["{}", "{}"])
+    with mock.patch("requests.Session.get", return_value=response):
+        lines = lichess_api.get_last_games_ndjson("Jrjrjr4", 2)
+        assert list(lines) == ["{}", "{}"]
+    response.close.assert_called_once()
+
+
+def test_get_last_games_ndjson_raises_when_stream_breaks():
+    def broken_lines(decode_unicode):
+        yield "{}"
+        raise requests.exceptions.ChunkedEncodingError("connection reset")
+
+    response = mock.Mock()
+    response.iter_lines.side_effect = broken_lines
+    with mock.patch("requests.Session.get", return_value=response):
+        lines = lichess_api.get_last_games_ndjson("Jrjrjr4", 2)
+        with pytest.raises(requests.exceptions.ChunkedEncodingError):
+            list(lines)
+    response.close.assert_called_once()
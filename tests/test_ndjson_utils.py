@@ -0,0 +1,109 @@
+import json
+import chess
+import pytest
+from logic.chess_utils import find_book_exit, find_deviation, read_pgn
+from logic.deviation_result import BookExit
+from logic.ndjson_utils import ndjson_line_to_game, ndjson_to_game_list
+
+PGN_PATH = "pgns/"
+
+
+def pgn_to_ndjson_line(pgn_path):
+    """Builds the NDJSON export line Lichess would return for a PGN file."""
+    game = read_pgn(PGN_PATH + pgn_path)
+    board = game.board()
+    moves = []
+    for move in game.mainline_moves():
+        moves.append(board.san(move))
+        board.push(move)
+    return json.dumps(
+        {
+            "id": "EE8nALl4",
+            "players": {
+                "white": {"user": {"name": game.headers["White"]}, "rating": 2111},
+                "black": {"user": {"name": game.headers["Black"]}, "rating": 2115},
+            },
+            "moves": " ".join(moves),
+        }
+    )
+
+
+@pytest.mark.parametrize(
+    "ref_pgn_path, my_pgn_path, player",
+    [
+        ("ref-acc-dragon-1.pgn", "a5-should-be-Re8-jrjrjr4.pgn", "Jrjrjr4"),
+        ("acc-dragon-test-1.pgn", "opponent-deviates-first.pgn", "Jrjrjr4"),
+        ("acc-dragon-test-1.pgn", "jrjrjr4-last-game-mar-2.pgn", "Jrjrjr4"),
+        ("carlsen-nakamura-2020.pgn", "harpseal-rayrey784.pgn", "HarpSeal"),
+    ],
+)
+def test_ndjson_game_matches_pgn_game(ref_pgn_path, my_pgn_path, player):
+    ref_game = read_pgn(PGN_PATH + ref_pgn_path)
+    pgn_game = read_pgn(PGN_PATH + my_pgn_path)
+    ndjson_game = ndjson_line_to_game(pgn_to_ndjson_line(my_pgn_path))
+    assert find_deviation(ref_game, ndjson_game, player) == find_deviation(
+        ref_game, pgn_game, player
+    )
+    assert find_book_exit(ref_game, ndjson_game, player) == find_book_exit(
+        ref_game, pgn_game, player
+    )
+
+
+def test_ndjson_line_to_game_reads_players():
+    line = json.dumps(
+        {
+            "id": "abcdefgh",
+            "players": {"white": {"user": {"name": "Jrjrjr4"}}, "black": {"aiLevel": 3}},
+            "moves": "e4 e5",
+        }
+    )
+    game = ndjson_line_to_game(line)
+    assert game.headers["White"] == "Jrjrjr4"
+    assert game.headers["Black"] == "?"
+    assert game.headers["Site"] == "https://lichess.org/abcdefgh"
+    assert game.moves_san == ["e4", "e5"]
+
+
+def test_ndjson_to_game_list_skips_blank_lines():
+    lines = [pgn_to_ndjson_line("harpseal-rayrey784.pgn"), "", pgn_to_ndjson_line("jrjrjr4-last-game.pgn")]
+    assert len(ndjson_to_game_list(lines)) == 2
+
+
+def test_ndjson_game_replays_variant_moves():
+    # A crazyhouse game that follows the repertoire, then drops a pawn instead of playing 4...g6
+    line = json.dumps(
+        {
+            "id": "abcdefgh",
+            "variant": "crazyhouse",
+            "players": {
+                "white": {"user": {"name": "eins_zwo_risiko"}},
+                "black": {"user": {"name": "Jrjrjr4"}},
+            },
+            "moves": "e4 c5 Nf3 Nc6 d4 cxd4 Nxd4 P@e6",
+        }
+    )
+    ref_game = read_pgn(PGN_PATH + "acc-dragon-test-1.pgn")
+    game = ndjson_line_to_game(line)
+    assert game.headers["Variant"] == "Crazyhouse"
+    assert find_book_exit(ref_game, game, "Jrjrjr4") == BookExit(
+        8, "@e6", ["g6"], "Black", True
+    )
+
+
+def test_ndjson_game_replays_chess960_castling():
+    line = json.dumps(
+        {
+            "id": "abcdefgh",
+            "variant": "chess960",
+            "initialFen": "bqnbrkrn/pppppppp/8/8/8/8/PPPPPPPP/BQNBRKRN w KQkq - 0 1",
+            "players": {
+                "white": {"user": {"name": "Jrjrjr4"}},
+                "black": {"user": {"name": "eins_zwo_risiko"}},
+            },
+            "moves": "g4 g5 Ng3 Ng6 O-O",
+        }
+    )
+    game = ndjson_line_to_game(line)
+    assert game.board().chess960
+    moves = list(game.mainline_moves())
+    assert moves[-1] == chess.Move.from_uci("f1g1")